@@ -1,8 +1,11 @@
 # Dashbaord.py
 
 import datetime
+import os
+import tempfile
 from pathlib import Path
 
+import numpy as np
 import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
@@ -25,6 +28,15 @@ BASE_DIR = Path(__file__).parent
 DATA_PATH = BASE_DIR / "Adidas.xlsx"
 LOGO_PATH = BASE_DIR / "adidas-logo.jpg"
 
+# Layout of the Parquet sidecar written by load_data; bump whenever read_workbook
+# changes the columns or dtypes it produces so stale sidecars are ignored
+SIDECAR_VERSION = 3
+
+# Front-end payload caps: bars per chart and rows in the raw-data preview
+MAX_BARS = 25
+RAW_PREVIEW_ROWS = 500
+MAX_MARKER_POINTS = 2000  # beyond this, line traces drop their markers
+
 # ------------------------------------------------------------------------------
 # GLOBAL STYLES
 # ------------------------------------------------------------------------------
@@ -85,13 +97,12 @@ st.markdown(
 # ------------------------------------------------------------------------------
 # LOAD & CLEAN DATA
 # ------------------------------------------------------------------------------
-@st.cache_data
-def load_data(path: Path) -> pd.DataFrame:
-    if not path.exists():
-        st.error(f"❌ Could not find data file at:\n\n{path}")
-        st.stop()
-
-    df_ = pd.read_excel(path)
+def read_workbook(path: Path) -> pd.DataFrame:
+    df_ = pd.read_excel(
+        path,
+        engine="openpyxl",
+        engine_kwargs={"read_only": True, "data_only": True},
+    )
 
     # --- Normalize column names we use later so app doesn't crash ---
     cols = df_.columns
@@ -117,27 +128,231 @@ def load_data(path: Path) -> pd.DataFrame:
     # Time fields
     if "InvoiceDate" in df_.columns:
         df_["Year"] = df_["InvoiceDate"].dt.year
-        df_["Month_Year"] = df_["InvoiceDate"].dt.strftime("%b '%y")
+        df_["MonthPeriod"] = df_["InvoiceDate"].dt.to_period("M")
+
+    # Low-cardinality filter columns: group and filter on integer codes
+    for c in ("Region", "Retailer", "State", "City", "Product", "SalesMethod"):
+        if c in df_.columns:
+            df_[c] = df_[c].astype("category")
 
     return df_
 
 
-df = load_data(DATA_PATH)
+def write_sidecar(df_: pd.DataFrame, pq_path: Path) -> None:
+    # Cache the normalized frame so later cold starts skip the Excel parse.
+    # Written to a temp file in the same directory and swapped in with os.replace,
+    # so an interrupted write never leaves a truncated sidecar behind.
+    try:
+        fd, tmp_name = tempfile.mkstemp(
+            dir=pq_path.parent, prefix=f"{pq_path.stem}.", suffix=".parquet.tmp"
+        )
+    except OSError:
+        return  # read-only deployment: keep serving from the workbook
+    os.close(fd)
+
+    try:
+        df_.to_parquet(tmp_name, engine="pyarrow", compression="zstd")
+        os.chmod(tmp_name, 0o644)  # mkstemp creates files owner-only
+        os.replace(tmp_name, pq_path)
+    except (OSError, ValueError, TypeError):
+        # Disk full, or pyarrow rejecting a column (e.g. a mixed-type categorical):
+        # the sidecar is only a cache, so keep serving from the workbook
+        pass
+    finally:
+        Path(tmp_name).unlink(missing_ok=True)
+
+
+@st.cache_data
+def load_data(
+    path: Path,
+) -> tuple[pd.DataFrame, pd.Timestamp | None, pd.Timestamp | None, bool]:
+    if not path.exists():
+        st.error(f"❌ Could not find data file at:\n\n{path}")
+        st.stop()
+
+    # --- Read the Parquet sidecar when it is up to date with the workbook ---
+    pq_path = path.with_suffix(f".v{SIDECAR_VERSION}.parquet")
+    df_ = None
+    if pq_path.exists() and pq_path.stat().st_mtime >= path.stat().st_mtime:
+        try:
+            df_ = pd.read_parquet(pq_path, engine="pyarrow")
+        except (OSError, ValueError):
+            df_ = None  # truncated or corrupt sidecar: rebuild it from the workbook
+
+    if df_ is None:
+        df_ = read_workbook(path)
+        write_sidecar(df_, pq_path)
+
+    # Date-filter bounds, computed once here rather than on every rerun.
+    # dates_complete is False when coerced blank/bad dates left NaT rows behind.
+    date_min = date_max = None
+    dates_complete = False
+    if "InvoiceDate" in df_.columns:
+        date_min, date_max = df_["InvoiceDate"].agg(["min", "max"])
+        dates_complete = bool(df_["InvoiceDate"].notna().all())
+
+    return df_, date_min, date_max, dates_complete
+
+
+def selection_key(selected: list, full: list):
+    # Hashable cache key for a multiselect; None when it filters nothing out.
+    # Options come from `full` without repeats, so equal length means all picked.
+    if not full or len(selected) == len(full):
+        return None
+    return tuple(sorted(selected))
+
+
+def apply_isin(mask: np.ndarray, df_: pd.DataFrame, col: str, selected) -> np.ndarray:
+    # Skip the full-column isin scan entirely for an inactive (None) filter
+    if selected is not None:
+        mask &= df_[col].isin(selected).to_numpy()
+    return mask
+
+
+def filter_mask(df_: pd.DataFrame, region, retailer, state, date_lo, date_hi) -> np.ndarray:
+    # AND every active predicate into one mask; None skips that filter
+    mask = np.ones(len(df_), dtype=bool)
+    mask = apply_isin(mask, df_, "Region", region)
+    mask = apply_isin(mask, df_, "Retailer", retailer)
+    mask = apply_isin(mask, df_, "State", state)
+
+    if date_lo is not None:
+        invoice_dates = df_["InvoiceDate"].to_numpy()
+        mask &= (invoice_dates >= np.datetime64(date_lo)) & (
+            invoice_dates < np.datetime64(date_hi)
+        )
+
+    return mask
+
+
+@st.cache_data
+def agg_by(keys: tuple, values: tuple, region, retailer, state, date_lo, date_hi) -> pd.DataFrame:
+    # Keyed by the filter selection, so the cached base frame is never re-hashed
+    df_ = load_data(DATA_PATH)[0]
+    df_sel = df_.loc[filter_mask(df_, region, retailer, state, date_lo, date_hi)]
+    return (
+        df_sel.groupby(list(keys), observed=True, sort=False)[list(values)]
+        .sum()
+        .reset_index()
+    )
+
+
+def fused_agg(keys: tuple, columns, filter_key: tuple) -> pd.DataFrame | None:
+    # One fused TotalSales/UnitsSold aggregate per grouping key; each chart block
+    # requests its own, so panels in hidden detail tabs cost nothing.
+    # None when the dataset lacks the grouping or value columns.
+    value_cols = tuple(c for c in ("TotalSales", "UnitsSold") if c in columns)
+    if not value_cols or not set(keys).issubset(columns):
+        return None
+    return agg_by(keys, value_cols, *filter_key)
+
+
+@st.cache_data
+def to_csv_bytes(df_: pd.DataFrame) -> bytes:
+    # Download payload for the small aggregate tables
+    return df_.to_csv(index=False).encode("utf-8")
+
+
+@st.cache_data(max_entries=4)
+def filtered_csv_bytes(region, retailer, state, date_lo, date_hi) -> bytes:
+    # Raw-data download keyed by the selection; bounded since each entry is large
+    df_ = load_data(DATA_PATH)[0]
+    df_sel = df_.loc[filter_mask(df_, region, retailer, state, date_lo, date_hi)]
+    return df_sel.to_csv(index=False).encode("utf-8")
+
+
+def note_hidden_bars(fig: go.Figure, n_hidden: int) -> None:
+    # Flag categories dropped by the MAX_BARS cap in the chart corner
+    if n_hidden > 0:
+        fig.add_annotation(
+            text=f"+{n_hidden} more",
+            xref="paper",
+            yref="paper",
+            x=1,
+            y=1,
+            showarrow=False,
+            font=dict(color="#9ca3af"),
+        )
+
+
+def group_thousands(text: np.ndarray) -> np.ndarray:
+    # Insert "," separators into printf-formatted numbers, as format(x, ",") does
+    if text.size == 0:
+        return text  # np.char.partition cannot size an empty result
+    neg = np.char.startswith(text, "-")
+    parts = np.char.partition(np.char.lstrip(text, "-"), ".")
+    n = parts[:, 0].astype(np.int64)
+
+    # Peel three-digit groups off the right; only the leading group is unpadded
+    lead, low = n % 1000, np.full(n.shape, "")
+    n //= 1000
+    while n.any():
+        has_more = n > 0
+        low = np.where(has_more, np.char.add(np.char.mod(",%03d", lead), low), low)
+        lead = np.where(has_more, n % 1000, lead)
+        n //= 1000
+
+    digits = np.char.add(np.char.mod("%d", lead), low)
+    digits = np.char.add(np.char.add(digits, parts[:, 1]), parts[:, 2])
+    return np.char.add(np.where(neg, "-", ""), digits)
+
+
+def format_sales(values: pd.Series) -> np.ndarray:
+    # "$1.2 M" / "$3.4 K" / "$567" labels, branched with np.select instead of per-row Python
+    v = values.to_numpy(dtype=float)
+    finite = np.isfinite(v)
+    v_fmt = np.where(finite, v, 0.0)  # keep NaN/inf out of the int64 digit grouping
+
+    millions = group_thousands(np.char.mod("%.1f", v_fmt / 1_000_000))
+    thousands = group_thousands(np.char.mod("%.1f", v_fmt / 1_000))
+    units = group_thousands(np.char.mod("%.0f", v_fmt))
+    return np.select(
+        [~finite, v >= 1_000_000, v >= 1_000],
+        [
+            "",
+            np.char.add(np.char.add("$", millions), " M"),
+            np.char.add(np.char.add("$", thousands), " K"),
+        ],
+        default=np.char.add("$", units),
+    )
+
+
+@st.cache_resource
+def get_logo(path: Path) -> Image.Image | None:
+    # Decode the JPEG once per process instead of on every rerun
+    if not path.exists():
+        return None
+    image_ = Image.open(path)
+    image_.load()
+    return image_
+
+
+def kpi_card(label: str, value: str, sub: str) -> None:
+    # One markdown element per card, so the wrapper div actually encloses its content
+    st.markdown(
+        f'<div class="metric-card">'
+        f'<div class="metric-label">{label}</div>'
+        f'<div class="metric-value">{value}</div>'
+        f'<div class="metric-sub">{sub}</div>'
+        "</div>",
+        unsafe_allow_html=True,
+    )
+
+
+df, min_date, max_date, dates_complete = load_data(DATA_PATH)
 
 # ------------------------------------------------------------------------------
 # HEADER (TITLE + LOGO)
 # ------------------------------------------------------------------------------
-if LOGO_PATH.exists():
-    image = Image.open(LOGO_PATH)
-else:
-    image = None
+image = get_logo(LOGO_PATH)
+if image is None:
     st.warning(f"⚠ Logo not found at: {LOGO_PATH}. The app will still work without the image.")
 
 col_logo, col_title = st.columns([0.12, 0.88])
 
 with col_logo:
     if image is not None:
-        st.image(image, width=110)
+        st.image(image, width=110, output_format="JPEG")
 
 with col_title:
     html_title = """
@@ -161,7 +376,7 @@ st.markdown("---")
 # ------------------------------------------------------------------------------
 with st.sidebar:
     if image is not None:
-        st.image(image)
+        st.image(image, output_format="JPEG")
     st.markdown(
         "<h3 style='color:white;'>🔍 Filter Your View</h3>",
         unsafe_allow_html=True,
@@ -190,8 +405,6 @@ with st.sidebar:
 
     # Date range filter
     if "InvoiceDate" in df.columns:
-        min_date = df["InvoiceDate"].min()
-        max_date = df["InvoiceDate"].max()
         date_range = st.date_input(
             "Invoice Date Range",
             value=(min_date.date(), max_date.date()),
@@ -202,18 +415,8 @@ with st.sidebar:
         date_range = None
 
 # Apply filters
-df_filtered = df.copy()
-
-if region_list:
-    df_filtered = df_filtered[df_filtered["Region"].isin(selected_region)]
-
-if retailer_list:
-    df_filtered = df_filtered[df_filtered["Retailer"].isin(selected_retailer)]
-
-if state_list:
-    df_filtered = df_filtered[df_filtered["State"].isin(selected_state)]
-
-if date_range is not None and "InvoiceDate" in df_filtered.columns:
+start_date = end_date = None
+if date_range is not None and "InvoiceDate" in df.columns:
     if isinstance(date_range, tuple):
         start_date = pd.to_datetime(date_range[0])
         end_date = pd.to_datetime(date_range[1]) + pd.Timedelta(days=1)
@@ -221,47 +424,48 @@ if date_range is not None and "InvoiceDate" in df_filtered.columns:
         start_date = pd.to_datetime(date_range)
         end_date = start_date + pd.Timedelta(days=1)
 
-    df_filtered = df_filtered[
-        (df_filtered["InvoiceDate"] >= start_date) & (df_filtered["InvoiceDate"] < end_date)
-    ]
+    # The full default window filters nothing out, unless it has undated rows to drop
+    if dates_complete and start_date <= min_date and end_date > max_date:
+        start_date = end_date = None
+
+filter_key = (
+    selection_key(selected_region, region_list),
+    selection_key(selected_retailer, retailer_list),
+    selection_key(selected_state, state_list),
+    start_date,
+    end_date,
+)
+
+if any(key is not None for key in filter_key):
+    df_filtered = df.loc[filter_mask(df, *filter_key)]
+else:
+    df_filtered = df  # no active filter: reuse the cached frame, downstream only reads it
 
 # ------------------------------------------------------------------------------
 # KPI CARDS
 # ------------------------------------------------------------------------------
-total_sales = df_filtered["TotalSales"].sum() if "TotalSales" in df_filtered.columns else 0
-total_units = df_filtered["UnitsSold"].sum() if "UnitsSold" in df_filtered.columns else 0
+# Reduce straight over the NumPy column buffers (nansum keeps pandas' skipna)
+total_sales = total_units = 0
+if "TotalSales" in df_filtered.columns:
+    total_sales = np.nansum(df_filtered["TotalSales"].to_numpy())
+if "UnitsSold" in df_filtered.columns:
+    total_units = np.nansum(df_filtered["UnitsSold"].to_numpy())
 total_orders = len(df_filtered)
 avg_order_value = total_sales / total_orders if total_orders > 0 else 0
 
 col_kpi1, col_kpi2, col_kpi3, col_kpi4 = st.columns(4)
 
 with col_kpi1:
-    st.markdown('<div class="metric-card">', unsafe_allow_html=True)
-    st.markdown('<div class="metric-label">Total Revenue</div>', unsafe_allow_html=True)
-    st.markdown(f'<div class="metric-value">${total_sales:,.0f}</div>', unsafe_allow_html=True)
-    st.markdown('<div class="metric-sub">Sum of Total Sales</div>', unsafe_allow_html=True)
-    st.markdown("</div>", unsafe_allow_html=True)
+    kpi_card("Total Revenue", f"${total_sales:,.0f}", "Sum of Total Sales")
 
 with col_kpi2:
-    st.markdown('<div class="metric-card">', unsafe_allow_html=True)
-    st.markdown('<div class="metric-label">Units Sold</div>', unsafe_allow_html=True)
-    st.markdown(f'<div class="metric-value">{int(total_units):,}</div>', unsafe_allow_html=True)
-    st.markdown('<div class="metric-sub">All Products</div>', unsafe_allow_html=True)
-    st.markdown("</div>", unsafe_allow_html=True)
+    kpi_card("Units Sold", f"{int(total_units):,}", "All Products")
 
 with col_kpi3:
-    st.markdown('<div class="metric-card">', unsafe_allow_html=True)
-    st.markdown('<div class="metric-label">Number of Invoices</div>', unsafe_allow_html=True)
-    st.markdown(f'<div class="metric-value">{total_orders:,}</div>', unsafe_allow_html=True)
-    st.markdown('<div class="metric-sub">Transactions in Selection</div>', unsafe_allow_html=True)
-    st.markdown("</div>", unsafe_allow_html=True)
+    kpi_card("Number of Invoices", f"{total_orders:,}", "Transactions in Selection")
 
 with col_kpi4:
-    st.markdown('<div class="metric-card">', unsafe_allow_html=True)
-    st.markdown('<div class="metric-label">Avg. Order Value</div>', unsafe_allow_html=True)
-    st.markdown(f'<div class="metric-value">${avg_order_value:,.0f}</div>', unsafe_allow_html=True)
-    st.markdown('<div class="metric-sub">TotalSales / Invoices</div>', unsafe_allow_html=True)
-    st.markdown("</div>", unsafe_allow_html=True)
+    kpi_card("Avg. Order Value", f"${avg_order_value:,.0f}", "TotalSales / Invoices")
 
 st.markdown("")
 
@@ -279,16 +483,16 @@ with col3:
     )
 
     if {"Retailer", "TotalSales"}.issubset(df_filtered.columns):
-        data_retailer = (
-            df_filtered.groupby("Retailer")["TotalSales"]
-            .sum()
-            .reset_index()
-            .sort_values("TotalSales", ascending=False)
+        g_retailer = fused_agg(("Retailer",), df.columns, filter_key)
+        # Ranked once here; the bars, expander table and CSV all use this order
+        data_retailer = g_retailer[["Retailer", "TotalSales"]].sort_values(
+            "TotalSales", ascending=False
         )
 
         if not data_retailer.empty:
+            plot_retailer = data_retailer.head(MAX_BARS)
             fig_retailer = px.bar(
-                data_retailer,
+                plot_retailer,
                 x="Retailer",
                 y="TotalSales",
                 labels={"TotalSales": "Total Sales ($)", "Retailer": "Retailer"},
@@ -302,7 +506,9 @@ with col3:
                 yaxis_title="Total Sales ($)",
                 bargap=0.25,
                 margin=dict(l=10, r=10, t=10, b=10),
+                uirevision="static",
             )
+            note_hidden_bars(fig_retailer, len(data_retailer) - len(plot_retailer))
             st.plotly_chart(fig_retailer, use_container_width=True)
 
             exp1, dwn1 = st.columns([0.6, 0.4])
@@ -312,7 +518,7 @@ with col3:
             with dwn1:
                 st.download_button(
                     "⬇ Download Retailer Data",
-                    data_retailer.to_csv(index=False).encode("utf-8"),
+                    to_csv_bytes(data_retailer),
                     file_name="RetailerSales.csv",
                     mime="text/csv",
                 )
@@ -329,26 +535,32 @@ with col4:
         unsafe_allow_html=True,
     )
 
-    if {"Month_Year", "TotalSales"}.issubset(df_filtered.columns):
-        result_time = (
-            df_filtered.groupby("Month_Year")["TotalSales"]
-            .sum()
-            .reset_index()
-            .sort_values("Month_Year")
-        )
+    if {"MonthPeriod", "TotalSales"}.issubset(df_filtered.columns):
+        g_month = fused_agg(("MonthPeriod",), df.columns, filter_key)
+        # Sort chronologically on the period, then label only the monthly rows
+        result_time = g_month.sort_values("MonthPeriod")
+        result_time["Month_Year"] = result_time["MonthPeriod"].dt.strftime("%b '%y")
+        result_time = result_time[["Month_Year", "TotalSales"]]
 
         if not result_time.empty:
-            fig_time = px.line(
-                result_time,
-                x="Month_Year",
-                y="TotalSales",
-                markers=True,
-                labels={"TotalSales": "Total Sales ($)", "Month_Year": "Month"},
+            # WebGL trace: drawn on a canvas instead of one SVG node per point
+            fig_time = go.Figure(
+                go.Scattergl(
+                    x=result_time["Month_Year"],
+                    y=result_time["TotalSales"],
+                    mode="lines+markers" if len(result_time) <= MAX_MARKER_POINTS else "lines",
+                    line=dict(width=3),
+                    hovertemplate="Month=%{x}<br>Total Sales ($)=%{y}<extra></extra>",
+                )
+            )
+            fig_time.update_layout(
                 template="plotly_dark",
                 height=430,
+                xaxis_title="Month",
+                yaxis_title="Total Sales ($)",
+                margin=dict(l=10, r=10, t=10, b=10),
+                uirevision="static",
             )
-            fig_time.update_traces(line=dict(width=3))
-            fig_time.update_layout(margin=dict(l=10, r=10, t=10, b=10))
             st.plotly_chart(fig_time, use_container_width=True)
 
             exp2, dwn2 = st.columns([0.6, 0.4])
@@ -358,7 +570,7 @@ with col4:
             with dwn2:
                 st.download_button(
                     "⬇ Download Monthly Sales Data",
-                    result_time.to_csv(index=False).encode("utf-8"),
+                    to_csv_bytes(result_time),
                     file_name="MonthlySales.csv",
                     mime="text/csv",
                 )
@@ -370,219 +582,226 @@ with col4:
 st.markdown("---")
 
 # ------------------------------------------------------------------------------
-# ROW 2 – STATE PERFORMANCE & PRODUCT/METHOD ANALYSIS
+# ROWS 2 & 3 – DETAIL TABS (ONLY THE SELECTED ONE IS BUILT EACH RERUN)
 # ------------------------------------------------------------------------------
-col5, col6 = st.columns([0.55, 0.45])
+# st.tabs with on_change="rerun" tracks the selected tab, so each body is gated
+# on .open and only the visible panel's figures and payloads are built
+tab_state, tab_mix, tab_geo, tab_raw = st.tabs(
+    ["State Performance", "Product & Sales Mix", "Region & City Heatmap", "Raw Dataset"],
+    key="detail_tabs",
+    on_change="rerun",
+)
 
 # State performance with combo chart
-with col5:
-    st.markdown('<div class="section-title">State Performance</div>', unsafe_allow_html=True)
-    st.markdown(
-        '<div class="section-subtitle">View sales and units sold by state in one glance.</div>',
-        unsafe_allow_html=True,
-    )
-
-    if {"State", "TotalSales", "UnitsSold"}.issubset(df_filtered.columns):
-        result_state = (
-            df_filtered.groupby("State")[["TotalSales", "UnitsSold"]]
-            .sum()
-            .reset_index()
-            .sort_values("TotalSales", ascending=False)
+with tab_state:
+    if tab_state.open:
+        st.markdown('<div class="section-title">State Performance</div>', unsafe_allow_html=True)
+        st.markdown(
+            '<div class="section-subtitle">View sales and units sold by state in one glance.</div>',
+            unsafe_allow_html=True,
         )
 
-        if not result_state.empty:
-            fig_state = go.Figure()
-            fig_state.add_trace(
-                go.Bar(
-                    x=result_state["State"],
-                    y=result_state["TotalSales"],
-                    name="Total Sales ($)",
-                )
-            )
-            fig_state.add_trace(
-                go.Scatter(
-                    x=result_state["State"],
-                    y=result_state["UnitsSold"],
-                    name="Units Sold",
-                    mode="lines+markers",
-                    yaxis="y2",
-                )
+        if {"State", "TotalSales", "UnitsSold"}.issubset(df_filtered.columns):
+            g_state = fused_agg(("State",), df.columns, filter_key)
+            result_state = (
+                g_state[["State", "TotalSales", "UnitsSold"]]
+                .sort_values("TotalSales", ascending=False)
             )
 
-            fig_state.update_layout(
-                template="plotly_dark",
-                height=450,
-                margin=dict(l=10, r=10, t=10, b=10),
-                xaxis=dict(title="State"),
-                yaxis=dict(title="Total Sales ($)", showgrid=False),
-                yaxis2=dict(
-                    title="Units Sold",
-                    overlaying="y",
-                    side="right",
-                    showgrid=False,
-                ),
-                legend=dict(
-                    orientation="h",
-                    yanchor="bottom",
-                    y=1.02,
-                    xanchor="right",
-                    x=1,
-                ),
-            )
-            st.plotly_chart(fig_state, use_container_width=True)
+            if not result_state.empty:
+                plot_state = result_state.head(MAX_BARS)
+                fig_state = go.Figure()
+                fig_state.add_trace(
+                    go.Bar(
+                        x=plot_state["State"],
+                        y=plot_state["TotalSales"],
+                        name="Total Sales ($)",
+                    )
+                )
+                fig_state.add_trace(
+                    go.Scattergl(
+                        x=plot_state["State"],
+                        y=plot_state["UnitsSold"],
+                        name="Units Sold",
+                        mode="lines+markers",
+                        yaxis="y2",
+                    )
+                )
 
-            exp3, dwn3 = st.columns([0.6, 0.4])
-            with exp3:
-                expander = st.expander("📊 State-wise Sales & Units Data")
-                expander.write(result_state)
-            with dwn3:
-                st.download_button(
-                    "⬇ Download State Data",
-                    result_state.to_csv(index=False).encode("utf-8"),
-                    file_name="Sales_by_State.csv",
-                    mime="text/csv",
+                fig_state.update_layout(
+                    template="plotly_dark",
+                    height=450,
+                    margin=dict(l=10, r=10, t=10, b=10),
+                    uirevision="static",
+                    xaxis=dict(title="State"),
+                    yaxis=dict(title="Total Sales ($)", showgrid=False),
+                    yaxis2=dict(
+                        title="Units Sold",
+                        overlaying="y",
+                        side="right",
+                        showgrid=False,
+                    ),
+                    legend=dict(
+                        orientation="h",
+                        yanchor="bottom",
+                        y=1.02,
+                        xanchor="right",
+                        x=1,
+                    ),
                 )
+                note_hidden_bars(fig_state, len(result_state) - len(plot_state))
+                st.plotly_chart(fig_state, use_container_width=True)
+
+                exp3, dwn3 = st.columns([0.6, 0.4])
+                with exp3:
+                    expander = st.expander("📊 State-wise Sales & Units Data")
+                    expander.write(result_state)
+                with dwn3:
+                    st.download_button(
+                        "⬇ Download State Data",
+                        to_csv_bytes(result_state),
+                        file_name="Sales_by_State.csv",
+                        mime="text/csv",
+                    )
+            else:
+                st.warning("No state-level data available for current filters.")
         else:
-            st.warning("No state-level data available for current filters.")
-    else:
-        st.info("State / TotalSales / UnitsSold columns not available.")
+            st.info("State / TotalSales / UnitsSold columns not available.")
 
 # Product & Sales Method analysis
-with col6:
-    st.markdown('<div class="section-title">Product & Sales Mix</div>', unsafe_allow_html=True)
-    st.markdown(
-        '<div class="section-subtitle">Which products or channels dominate revenue?</div>',
-        unsafe_allow_html=True,
-    )
-
-    # Top products
-    if {"Product", "TotalSales"}.issubset(df_filtered.columns):
-        prod_data = (
-            df_filtered.groupby("Product")["TotalSales"]
-            .sum()
-            .reset_index()
-            .sort_values("TotalSales", ascending=False)
-            .head(10)
+with tab_mix:
+    if tab_mix.open:
+        st.markdown('<div class="section-title">Product & Sales Mix</div>', unsafe_allow_html=True)
+        st.markdown(
+            '<div class="section-subtitle">Which products or channels dominate revenue?</div>',
+            unsafe_allow_html=True,
         )
 
-        if not prod_data.empty:
-            fig_prod = px.bar(
-                prod_data,
-                x="TotalSales",
-                y="Product",
-                orientation="h",
-                labels={"TotalSales": "Total Sales ($)", "Product": "Product"},
-                color="TotalSales",
-                color_continuous_scale="Plasma",
-                template="plotly_dark",
-                height=260,
-                title="Top 10 Products by Sales",
+        # Top products
+        if {"Product", "TotalSales"}.issubset(df_filtered.columns):
+            g_product = fused_agg(("Product",), df.columns, filter_key)
+            prod_data = (
+                g_product[["Product", "TotalSales"]]
+                .sort_values("TotalSales", ascending=False)
+                .head(10)
             )
-            fig_prod.update_layout(margin=dict(l=10, r=10, t=30, b=10))
-            st.plotly_chart(fig_prod, use_container_width=True)
-
-    # Sales method pie
-    if {"SalesMethod", "TotalSales"}.issubset(df_filtered.columns):
-        method_data = (
-            df_filtered.groupby("SalesMethod")["TotalSales"]
-            .sum()
-            .reset_index()
-        )
 
-        if not method_data.empty:
-            fig_method = px.pie(
-                method_data,
-                names="SalesMethod",
-                values="TotalSales",
-                template="plotly_dark",
-                hole=0.45,
-                title="Sales Share by Method",
-                height=260,
+            if not prod_data.empty:
+                fig_prod = px.bar(
+                    prod_data,
+                    x="TotalSales",
+                    y="Product",
+                    orientation="h",
+                    labels={"TotalSales": "Total Sales ($)", "Product": "Product"},
+                    color="TotalSales",
+                    color_continuous_scale="Plasma",
+                    template="plotly_dark",
+                    height=260,
+                    title="Top 10 Products by Sales",
+                )
+                fig_prod.update_layout(margin=dict(l=10, r=10, t=30, b=10), uirevision="static")
+                st.plotly_chart(fig_prod, use_container_width=True)
+
+        # Sales method pie
+        if {"SalesMethod", "TotalSales"}.issubset(df_filtered.columns):
+            g_method = fused_agg(("SalesMethod",), df.columns, filter_key)
+            method_data = g_method[["SalesMethod", "TotalSales"]].sort_values(
+                "SalesMethod", ignore_index=True
             )
-            fig_method.update_traces(textposition="inside", textinfo="percent+label")
-            st.plotly_chart(fig_method, use_container_width=True)
-
-st.markdown("---")
 
-# ------------------------------------------------------------------------------
-# ROW 3 – TREEMAP & RAW DATA
-# ------------------------------------------------------------------------------
-col7, col8 = st.columns([0.6, 0.4])
-
-with col7:
-    st.markdown('<div class="section-title">Region & City Heatmap</div>', unsafe_allow_html=True)
-    st.markdown(
-        '<div class="section-subtitle">Drill into the Adidas footprint across regions and cities.</div>',
-        unsafe_allow_html=True,
-    )
+            if not method_data.empty:
+                fig_method = px.pie(
+                    method_data,
+                    names="SalesMethod",
+                    values="TotalSales",
+                    template="plotly_dark",
+                    hole=0.45,
+                    title="Sales Share by Method",
+                    height=260,
+                )
+                fig_method.update_traces(textposition="inside", textinfo="percent+label")
+                # Share-of-total view: skip Plotly's hover/drag wiring and the mode bar
+                st.plotly_chart(
+                    fig_method,
+                    use_container_width=True,
+                    config={"staticPlot": True, "displayModeBar": False},
+                )
 
-    if {"Region", "City", "TotalSales"}.issubset(df_filtered.columns):
-        treemap = (
-            df_filtered[["Region", "City", "TotalSales"]]
-            .groupby(["Region", "City"])["TotalSales"]
-            .sum()
-            .reset_index()
+# Region & City treemap
+with tab_geo:
+    if tab_geo.open:
+        st.markdown('<div class="section-title">Region & City Heatmap</div>', unsafe_allow_html=True)
+        st.markdown(
+            '<div class="section-subtitle">Drill into the Adidas footprint across regions and cities.</div>',
+            unsafe_allow_html=True,
         )
 
-        if not treemap.empty:
-
-            def format_sales(value):
-                if pd.isna(value):
-                    return ""
-                if value >= 1_000_000:
-                    return f"${value / 1_000_000:,.1f} M"
-                if value >= 1_000:
-                    return f"${value / 1_000:,.1f} K"
-                return f"${value:,.0f}"
-
-            treemap["TotalSales (Formatted)"] = treemap["TotalSales"].apply(format_sales)
-
-            fig_tree = px.treemap(
-                treemap,
-                path=["Region", "City"],
-                values="TotalSales",
-                hover_data=["TotalSales (Formatted)"],
-                color="Region",
-                template="plotly_dark",
-                height=540,
+        if {"Region", "City", "TotalSales"}.issubset(df_filtered.columns):
+            g_region_city = fused_agg(("Region", "City"), df.columns, filter_key)
+            treemap = (
+                g_region_city[["Region", "City", "TotalSales"]]
+                # px.treemap aggregates its path columns, which categoricals reject
+                .astype({"Region": str, "City": str})
+                .sort_values(["Region", "City"], ignore_index=True)
             )
-            fig_tree.update_traces(textinfo="label+value")
-            st.plotly_chart(fig_tree, use_container_width=True)
-
-            exp4, dwn4 = st.columns([0.6, 0.4])
-            with exp4:
-                expander = st.expander("📊 Region & City Sales Data")
-                expander.write(
-                    treemap[["Region", "City", "TotalSales", "TotalSales (Formatted)"]]
-                )
-            with dwn4:
-                st.download_button(
-                    "⬇ Download Region-City Data",
-                    treemap.to_csv(index=False).encode("utf-8"),
-                    file_name="Sales_by_Region_City.csv",
-                    mime="text/csv",
+
+            if not treemap.empty:
+                treemap["TotalSales (Formatted)"] = format_sales(treemap["TotalSales"])
+
+                fig_tree = px.treemap(
+                    treemap,
+                    path=["Region", "City"],
+                    values="TotalSales",
+                    hover_data=["TotalSales (Formatted)"],
+                    color="Region",
+                    template="plotly_dark",
+                    height=540,
                 )
+                fig_tree.update_traces(textinfo="label+value")
+                fig_tree.update_layout(uirevision="static")
+                st.plotly_chart(fig_tree, use_container_width=True)
+
+                exp4, dwn4 = st.columns([0.6, 0.4])
+                with exp4:
+                    expander = st.expander("📊 Region & City Sales Data")
+                    expander.write(
+                        treemap[["Region", "City", "TotalSales", "TotalSales (Formatted)"]]
+                    )
+                with dwn4:
+                    st.download_button(
+                        "⬇ Download Region-City Data",
+                        to_csv_bytes(treemap),
+                        file_name="Sales_by_Region_City.csv",
+                        mime="text/csv",
+                    )
+            else:
+                st.warning("No region/city data available for current filters.")
         else:
-            st.warning("No region/city data available for current filters.")
-    else:
-        st.info("Region / City / TotalSales columns not available for Treemap.")
-
-with col8:
-    st.markdown('<div class="section-title">Raw Dataset (Filtered)</div>', unsafe_allow_html=True)
-    st.markdown(
-        '<div class="section-subtitle">Inspect individual transactions behind the charts.</div>',
-        unsafe_allow_html=True,
-    )
+            st.info("Region / City / TotalSales columns not available for Treemap.")
+
+# Filtered transactions
+with tab_raw:
+    if tab_raw.open:
+        st.markdown('<div class="section-title">Raw Dataset (Filtered)</div>', unsafe_allow_html=True)
+        st.markdown(
+            '<div class="section-subtitle">Inspect individual transactions behind the charts.</div>',
+            unsafe_allow_html=True,
+        )
 
-    exp_raw = st.expander("📄 View Raw Data")
-    exp_raw.write(df_filtered)
+        exp_raw = st.expander("📄 View Raw Data")
+        exp_raw.dataframe(df_filtered.head(RAW_PREVIEW_ROWS))
+        if len(df_filtered) > RAW_PREVIEW_ROWS:
+            exp_raw.caption(
+                f"Showing the first {RAW_PREVIEW_ROWS:,} of {len(df_filtered):,} rows; "
+                "download the filtered data for the full selection."
+            )
 
-    st.download_button(
-        "⬇ Download Filtered Raw Data",
-        df_filtered.to_csv(index=False).encode("utf-8"),
-        file_name="Adidas_Sales_Filtered.csv",
-        mime="text/csv",
-    )
+        st.download_button(
+            "⬇ Download Filtered Raw Data",
+            filtered_csv_bytes(*filter_key),
+            file_name="Adidas_Sales_Filtered.csv",
+            mime="text/csv",
+        )
 
 st.markdown("---")
 